@@ -1,6 +1,6 @@
 import os
 from flask import Flask, request, jsonify
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -8,12 +8,18 @@ load_dotenv()
 
 # Import matching pipeline components
 from parse import parse_address
-from match import exact_match, fuzzy_match
-from fallback import phonetic_match, api_match, embedding_match
+from canon import canon_address
+from pipeline import run_waterfall
 
-# Create DB engine from environment variable
+# Create DB engine from environment variable, with a connection pool sized
+# for concurrent requests
 DB_URL = os.getenv("ADDRESS_DB_URL")
-engine = create_engine(DB_URL)
+engine = create_engine(
+    DB_URL,
+    pool_size=16,
+    max_overflow=32,
+    pool_pre_ping=False
+)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -42,52 +48,11 @@ def match_address():
 
     # 2) Run the matching pipeline using waterfall strategy
     with engine.connect() as conn:
-        hhid, score, mtype, reason = None, 0.0, None, ""
+        hhid, score, mtype, reason = run_waterfall(conn, [parsed])[0]
+        reason = reason or "unmatched"
 
-        # Exact match
-        hhid, score = exact_match(conn, parsed)
-        if hhid:
-            mtype, reason = "exact", "exact match"
-        else:
-            reason = "no exact match"
-
-            # Fuzzy match
-            hhid, score = fuzzy_match(conn, parsed)
-            if hhid:
-                mtype, reason = "fuzzy", "fuzzy match"
-            else:
-                reason = "low fuzzy score"
-
-                # Phonetic match
-                hhid, score = phonetic_match(conn, parsed)
-                if hhid:
-                    mtype, reason = "phonetic", "phonetic match"
-                else:
-                    reason = "no phonetic match"
-
-                    # Embedding match
-                    hhid, score = embedding_match(conn, parsed, emb_threshold=0.75)
-                    if hhid:
-                        mtype, reason = "embedding", "embedding match"
-                    else:
-                        reason = "low embedding score"
-
-                        # API match
-                        hhid, score, api_reason = api_match(conn, parsed)
-                        if hhid:
-                            mtype, reason = "api", api_reason
-                        else:
-                            mtype, reason = "unmatched", api_reason or "unmatched"
-
-        # 3) Retrieve canonical matched address (if any)
-        matched_addr = None
-        if hhid:
-            row = conn.execute(
-                text("SELECT address FROM raw_addresses WHERE hhid = :hhid"),
-                {"hhid": hhid}
-            ).mappings().first()
-            if row:
-                matched_addr = row["address"]
+        # 3) Retrieve canonical matched address (if any) from the resident table
+        matched_addr = canon_address(conn, hhid) if hhid else None
 
     # Return match results as JSON
     return jsonify({
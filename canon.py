@@ -0,0 +1,78 @@
+import threading
+
+import polars as pl
+
+# Canonical address columns needed by the matchers
+CANON_QUERY = """
+    SELECT hhid, house, predir, street, strtype,
+           postdir, apttype, aptnbr, address, street_dm
+      FROM raw_addresses
+"""
+
+# Components joined into the full canonical street string (e.g. "N MAIN ST")
+STREET_COLS = ['predir', 'street', 'strtype', 'postdir']
+
+# Canonical table kept resident for the life of the process
+_CANON = None
+_BLOCKS = {}
+_ADDRESSES = {}
+_LOAD_LOCK = threading.Lock()
+
+
+def load_canon(conn, refresh: bool = False) -> pl.DataFrame:
+    """
+    Load `raw_addresses` into memory once and partition it by house number.
+
+    Later calls reuse the resident table unless `refresh` is set (e.g. after
+    a new ingest). Returns the full canonical DataFrame.
+
+    Safe to call from concurrent request threads: one thread loads while the
+    others wait, and `_CANON` is published only after the blocks and the
+    address map, so a reader that sees it loaded never sees them empty.
+    """
+    global _CANON, _BLOCKS, _ADDRESSES
+    if _CANON is not None and not refresh:
+        return _CANON
+
+    with _LOAD_LOCK:
+        if _CANON is not None and not refresh:
+            return _CANON  # Loaded by another thread while we waited
+
+        canon = pl.read_database(CANON_QUERY, conn)
+
+        # Precompute the canonical street string, skipping empty components
+        canon = canon.with_columns(
+            pl.concat_str(
+                [pl.when(pl.col(c) != '').then(pl.col(c)) for c in STREET_COLS],
+                separator=' ',
+                ignore_nulls=True
+            ).alias('canon_full')
+        )
+
+        _BLOCKS = {
+            house: block
+            for (house,), block in canon.partition_by('house', as_dict=True).items()
+        }
+        _ADDRESSES = dict(zip(canon['hhid'], canon['address']))
+        _CANON = canon
+        return _CANON
+
+
+def get_block(conn, house: str) -> pl.DataFrame:
+    """
+    Return the canonical rows sharing `house` as their house number
+    (an empty frame if there are none).
+    """
+    canon = load_canon(conn)
+    if not house:
+        return canon.clear()  # Rows without a house number form no block
+    block = _BLOCKS.get(house)
+    return block if block is not None else canon.clear()
+
+
+def canon_address(conn, hhid) -> str:
+    """
+    Return the canonical address string for `hhid` ('' if unknown).
+    """
+    load_canon(conn)
+    return _ADDRESSES.get(hhid) or ''
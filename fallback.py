@@ -1,133 +1,212 @@
 import os
+import threading
+
+# Let the CPU inference runtimes use every core; must be set before they load
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count()))
+
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from rapidfuzz import fuzz
-from metaphone import doublemetaphone
+from requests.adapters import HTTPAdapter
+import numpy as np
+import torch
+import polars as pl
+from rapidfuzz import fuzz, process
 from sqlalchemy import text
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
 
 # Load environment variables from .env
 load_dotenv()
 
+torch.set_num_threads(os.cpu_count())
 
-def phonetic_match(conn, parsed: dict, threshold: int = 70):
-    """
-    Perform phonetic matching using Double Metaphone and fuzzy scoring.
 
-    1) Block on street_number
-    2) Phonetic‐filter on street name
-    3) Filter out any candidate whose unit != parsed unit
-    4) If more than one remains, fuzzy‐score parsed_full vs canonical address
-    5) Return best match if score ≥ threshold
+def phonetic_match_block(parsed: dict, block: pl.DataFrame, threshold: int = 70):
     """
-    num = (parsed.get('street_number') or "").strip().upper()
-    parsed_unit = (parsed.get('unit') or "").strip().upper()
-    if not num:
-        return None, 0.0
+    Perform phonetic matching against one canonical house-number block,
+    using Double Metaphone and fuzzy scoring.
+
+    1) Phonetic-filter on street name
+    2) Filter out any candidate whose unit != parsed unit
+    3) If more than one remains, fuzzy-score parsed_full vs canonical address
+    4) Return best match if score ≥ threshold
 
-    # Query candidates with the same house number
-    q = text("""
-        SELECT hhid, street, address, aptnbr
-          FROM raw_addresses
-         WHERE house = :num
-    """)
-    rows = conn.execute(q, {'num': num}).mappings().all()
-    if not rows:
+    The block comes from `canon.get_block`, so the batched pipeline can share
+    one block across every transaction on a house number.
+    """
+    num = parsed.get('street_number', '')
+    parsed_unit = parsed.get('unit', '')
+    if not num or block.is_empty():
         return None, 0.0
 
-    # Build the full parsed street (for later fuzzy scoring)
-    tokens = [
-        parsed.get('predir', ''),
-        parsed.get('street_name', ''),
-        parsed.get('street_type', ''),
-        parsed.get('postdir', '')
-    ]
-    parsed_full = " ".join(t for t in tokens if t).upper()
+    # Full parsed street (for later fuzzy scoring), precomputed by parse_address
+    parsed_full = parsed.get('parsed_full', '')
 
-    # Filter candidates with matching phonetic street names
-    target_code = doublemetaphone(parsed.get('street_name', '').upper())[0]
-    phonetic = [
-        r for r in rows
-        if doublemetaphone((r['street'] or '').upper())[0] == target_code
-    ]
-    if not phonetic:
-        return None, 0.0
+    # Filter candidates with matching phonetic street names, comparing the
+    # codes precomputed at parse time and at ingest
+    target_code = parsed.get('street_name_dm', '')
+    phonetic = block.filter(pl.col('street_dm') == target_code)
 
     # Filter candidates where unit does not match
     if parsed_unit:
-        phonetic = [
-            r for r in phonetic
-            if (r.get('aptnbr') or "").strip().upper() == parsed_unit
-        ]
-        if not phonetic:
-            return None, 0.0
+        phonetic = phonetic.filter(pl.col('aptnbr') == parsed_unit)
+    if phonetic.is_empty():
+        return None, 0.0
 
     # Select best match using fuzzy string similarity on full address
-    best_hhid, best_score = None, 0.0
-    for r in phonetic:
-        score = fuzz.token_set_ratio(parsed_full, (r['address'] or "").upper())
-        if score > best_score:
-            best_hhid, best_score = r['hhid'], score
-
-    if best_score >= threshold:
-        return best_hhid, round(best_score, 2)
+    addresses = phonetic['address'].to_list()
+    scores = process.cdist([parsed_full], addresses, scorer=fuzz.token_set_ratio)[0]
+    best = int(np.argmax(scores))
+    best_score = float(scores[best])
+
+    if best_score > 0.0 and best_score >= threshold:
+        return phonetic['hhid'][best], round(best_score, 2)
     return None, 0.0
 
 
-# Load sentence embedding model once to reuse across function calls
-EMB_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
+# Sentence embedding model, loaded on first use and reused across calls.
+# Runs the dynamically int8-quantized ONNX export of the model through
+# onnxruntime; set EMB_ONNX_FILE to another export (e.g.
+# onnx/model_quint8_avx2.onnx) on CPUs without AVX512-VNNI.
+EMB_ONNX_FILE = os.getenv("EMB_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+_EMB_MODEL = None
+
+
+def _get_model() -> SentenceTransformer:
+    """
+    Return the embedding model, loading it on the first call, so importing
+    this module (e.g. in a worker process) does not pay for the load.
+    """
+    global _EMB_MODEL
+    if _EMB_MODEL is None:
+        _EMB_MODEL = SentenceTransformer(
+            'all-MiniLM-L6-v2',
+            backend='onnx',
+            model_kwargs={'file_name': EMB_ONNX_FILE}
+        )
+    return _EMB_MODEL
+
 
+# Embeddings keyed on the normalized address string, most recently used last.
+# Kept at module level so repeated addresses (e.g. across scale_test runs)
+# never go through the transformer twice. Shared by the Flask request
+# threads, so every access goes through _EMB_LOCK.
+EMB_CACHE_SIZE = 100_000
+_EMB_CACHE = OrderedDict()
+_EMB_LOCK = threading.Lock()
 
-def embedding_match(conn, parsed: dict, emb_threshold: float = 0.75):
+
+def _encode(texts):
     """
-    Perform fallback address match using text embeddings and cosine similarity.
+    Return normalized embeddings for `texts` as a (len(texts), dim) matrix.
 
-    1) Block on house number
-    2) Compute embeddings for parsed_full and each candidate.address
-    3) Enforce exact unit match
-    4) Return best match if cosine similarity ≥ threshold
+    Only strings missing from the LRU cache are encoded, de-duplicated and in
+    a single batch; hits are served from the cache. The model runs outside
+    the cache lock, so concurrent callers only serialize on the lookups.
     """
-    tokens = [
-        parsed.get('predir', ''),
-        parsed.get('street_name', ''),
-        parsed.get('street_type', ''),
-        parsed.get('postdir', '')
+    unique = list(dict.fromkeys(texts))
+    with _EMB_LOCK:
+        found = {t: _EMB_CACHE[t] for t in unique if t in _EMB_CACHE}
+
+    misses = [t for t in unique if t not in found]
+    if misses:
+        embs = _get_model().encode(
+            misses,
+            batch_size=64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        found.update(zip(misses, embs))
+
+    with _EMB_LOCK:
+        for t, emb in found.items():
+            _EMB_CACHE[t] = emb
+            _EMB_CACHE.move_to_end(t)
+
+        # Evict least recently used entries beyond the cache size
+        while len(_EMB_CACHE) > EMB_CACHE_SIZE:
+            _EMB_CACHE.popitem(last=False)
+
+    return np.stack([found[t] for t in texts])
+
+
+def embedding_match_many(pairs, emb_threshold: float = 0.75):
+    """
+    Embedding match many (parsed, candidate block) pairs at once.
+
+    Every parsed_full is encoded in one batched call, and every distinct
+    candidate block is encoded in a second one, so the transformer always
+    runs on full batches instead of one string per forward pass. Strings
+    already in the embedding cache skip the transformer entirely.
+    Embeddings are normalized, so cosine similarity is a plain dot product.
+
+    Returns a list of (hhid, score) tuples, one per pair.
+    """
+    matches = [(None, 0.0)] * len(pairs)
+
+    # Skip pairs without a street number or candidates
+    work = [
+        (i, parsed, block)
+        for i, (parsed, block) in enumerate(pairs)
+        if parsed.get('street_number', '') and not block.is_empty()
     ]
-    parsed_full = ' '.join(t for t in tokens if t).upper()
-    num = (parsed.get('street_number') or '').strip().upper()
-    parsed_unit = (parsed.get('unit') or '').strip().upper()
-    if not num:
-        return None, 0.0
+    if not work:
+        return matches
 
-    # Retrieve candidates with matching house number
-    q = text("SELECT hhid, address, aptnbr FROM raw_addresses WHERE house = :num")
-    rows = conn.execute(q, {'num': num}).mappings().all()
-    if not rows:
-        return None, 0.0
+    # Generate embeddings for every parsed input in one batch
+    parsed_fulls = [parsed.get('parsed_full', '') for _, parsed, _ in work]
+    parsed_embs = _encode(parsed_fulls)
+
+    # Generate embeddings for each distinct candidate block in one batch
+    offsets, cand_addrs = {}, []
+    for _, _, block in work:
+        if id(block) not in offsets:
+            offsets[id(block)] = len(cand_addrs)
+            cand_addrs.extend(block['address'])
+    cand_embs = _encode(cand_addrs)
 
-    # Generate embedding for the parsed input
-    parsed_emb = EMB_MODEL.encode(parsed_full, convert_to_numpy=True).reshape(1, -1)
+    for (i, parsed, block), parsed_emb in zip(work, parsed_embs):
+        start = offsets[id(block)]
+        sims = cand_embs[start:start + block.height] @ parsed_emb
 
-    best_hhid, best_score = None, 0.0
-    for r in rows:
         # Filter by unit if provided
-        canon_unit = (r.get('aptnbr') or '').strip().upper()
-        if parsed_unit and parsed_unit != canon_unit:
-            continue
+        parsed_unit = parsed.get('unit', '')
+        if parsed_unit:
+            unit_ok = (block['aptnbr'] == parsed_unit).to_numpy()
+            sims = np.where(unit_ok, sims, 0.0)
 
-        # Generate embedding for the candidate address
-        cand_addr = (r['address'] or '').strip().upper()
-        cand_emb = EMB_MODEL.encode(cand_addr, convert_to_numpy=True).reshape(1, -1)
+        best = int(np.argmax(sims))
+        best_score = float(sims[best])
+        if best_score > 0.0 and best_score >= emb_threshold:
+            matches[i] = (block['hhid'][best], round(best_score * 100, 2))
 
-        # Compute cosine similarity
-        cos_sim = float(cosine_similarity(parsed_emb, cand_emb)[0, 0])
-        if cos_sim > best_score:
-            best_hhid, best_score = r['hhid'], cos_sim
+    return matches
 
-    if best_hhid and best_score >= emb_threshold:
-        return best_hhid, round(best_score * 100, 2)
-    return None, 0.0
+
+# Geocodio geocoding endpoint (GET for one address, POST for a batch)
+GEOCODIO_URL = "https://api.geocod.io/v1.7/geocode"
+
+# Addresses per batch request, and batch requests in flight at once
+API_BATCH_SIZE = 1000
+API_WORKERS = 16
+
+# Keep-alive session shared by every API call
+API_SESSION = requests.Session()
+API_SESSION.mount("https://", HTTPAdapter(pool_maxsize=API_WORKERS))
+
+
+def _api_query(parsed: dict) -> str:
+    """
+    Build the complete address query string sent to the API.
+    """
+    street_part = parsed['original_address']
+    city_part = parsed.get('city', '')
+    state_part = parsed.get('state', '')
+    zip_part = parsed.get('zip_code', '')
+    return f"{street_part}, {city_part}, {state_part} {zip_part}".strip()
 
 
 def api_match(conn, parsed: dict):
@@ -144,19 +223,14 @@ def api_match(conn, parsed: dict):
         return None, 0.0, "no api key"
 
     # Build complete address query string
-    street_part = parsed['original_address']
-    city_part = parsed.get('city', '')
-    state_part = parsed.get('state', '')
-    zip_part = parsed.get('zip_code', '')
-    full = f"{street_part}, {city_part}, {state_part} {zip_part}".strip()
-
+    full = _api_query(parsed)
     if not full:
         return None, 0.0, "no original_address"
 
     # Call the API with timeout and error handling
     try:
-        resp = requests.get(
-            "https://api.geocod.io/v1.7/geocode",
+        resp = API_SESSION.get(
+            GEOCODIO_URL,
             params={"q": full, "api_key": key},
             timeout=5
         )
@@ -166,7 +240,111 @@ def api_match(conn, parsed: dict):
         return None, 0.0, "api request error"
 
     data = resp.json()
-    results = data.get("results", [])
+    return _api_lookup(conn, data.get("results", []))
+
+
+def _api_batch(queries, key):
+    """
+    Geocode one batch of address strings with a single POST.
+    Returns the list of API results for each query, in order.
+    """
+    resp = API_SESSION.post(
+        GEOCODIO_URL,
+        params={"api_key": key},
+        json=queries,
+        timeout=60
+    )
+    resp.raise_for_status()
+    return [
+        r.get("response", {}).get("results", [])
+        for r in resp.json().get("results", [])
+    ]
+
+
+def api_match_many(conn, parsed_list):
+    """
+    Batched `api_match` using Geocodio's batch endpoint.
+
+    Addresses are posted in chunks of API_BATCH_SIZE, with up to API_WORKERS
+    chunks in flight at once over the shared keep-alive session. The DB
+    lookups then run sequentially on `conn`.
+
+    Returns a list of (hhid, confidence, reason) tuples, one per parsed row.
+    """
+    # Load API key from environment for security
+    key = os.getenv("GEOCODIO_API_KEY")
+    if not key:
+        return [(None, 0.0, "no api key")] * len(parsed_list)
+
+    matches = [(None, 0.0, "no original_address")] * len(parsed_list)
+    todo = []
+    for i, parsed in enumerate(parsed_list):
+        full = _api_query(parsed)
+        if full:
+            todo.append((i, full))
+            matches[i] = (None, 0.0, "no api result")
+
+    chunks = [
+        todo[start:start + API_BATCH_SIZE]
+        for start in range(0, len(todo), API_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=API_WORKERS) as ex:
+        futures = [
+            ex.submit(_api_batch, [full for _, full in chunk], key)
+            for chunk in chunks
+        ]
+        for chunk, future in zip(chunks, futures):
+            try:
+                batch = future.result()
+            except Exception as e:
+                print(f"[api_match_many] request error for {len(chunk)} addresses:", e)
+                for i, _ in chunk:
+                    matches[i] = (None, 0.0, "api request error")
+                continue
+
+            for (i, _), results in zip(chunk, batch):
+                matches[i] = _api_lookup(conn, results)
+
+    return matches
+
+
+@lru_cache(maxsize=None)
+def _build_api_sql(has_predir: bool, has_postdir: bool, has_strtype: bool):
+    """
+    Build the API-result lookup query for one combination of present
+    optional components.
+
+    A blank predir/postdir/strtype from the API matches any value, so those
+    clauses are only emitted when the component is present, rather than as
+    `(:x = '' OR x = :x)` branches that keep the planner off the indexes.
+    Apartment type and number always compare by plain equality, since blanks
+    are stored as '' on both sides.
+    """
+    clauses = [
+        "house = :house",
+        "street = :street",
+        "zip = :zip5",
+    ]
+    if has_predir:
+        clauses.append("predir = :predir")
+    if has_postdir:
+        clauses.append("postdir = :postdir")
+    if has_strtype:
+        clauses.append("strtype = :strtype")
+    clauses += [
+        "apttype = :apt_type",
+        "aptnbr = :unit",
+    ]
+    return text(
+        "SELECT hhid FROM raw_addresses WHERE " + "\n   AND ".join(clauses)
+    )
+
+
+def _api_lookup(conn, results):
+    """
+    Attempt an exact DB match using the normalized components of the top
+    API result. Returns (hhid, confidence, reason).
+    """
     if not results:
         return None, 0.0, "no api result"
 
@@ -184,23 +362,7 @@ def api_match(conn, parsed: dict):
     zip5 = (top.get("zip") or "").strip()
 
     # Attempt exact DB match using normalized components from API
-    q = text("""
-        SELECT hhid FROM raw_addresses
-         WHERE house   = :house
-           AND street  = :street
-           AND zip     = :zip5
-           AND (:predir   = '' OR predir   = :predir)
-           AND (:postdir  = '' OR postdir  = :postdir)
-           AND (:strtype  = '' OR strtype  = :strtype)
-           AND (
-                (:apt_type = ''     AND apttype = '')
-            OR (:apt_type <> ''    AND apttype = :apt_type)
-           )
-           AND (
-                (:unit     = ''     AND aptnbr = '')
-            OR (:unit     <> ''    AND aptnbr = :unit)
-           )
-    """)
+    q = _build_api_sql(bool(predir), bool(postdir), bool(strtype))
     params = {
         "house": house,
         "street": street,
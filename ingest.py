@@ -1,6 +1,7 @@
 # Import necessary libraries
-import pandas as pd
-from sqlalchemy import create_engine
+import polars as pl
+from sqlalchemy import create_engine, text
+from metaphone import doublemetaphone
 from dotenv import load_dotenv
 import os
 
@@ -10,8 +11,78 @@ load_dotenv()
 # Use database URL from environment variable for security
 DB_URL = os.getenv("DB_URL")
 
+# Batch executemany inserts into multi-row VALUES pages (psycopg2 execute_values)
+ENGINE_OPTS = {
+    'executemany_mode': 'values_plus_batch',
+    'insertmanyvalues_page_size': 10_000,
+}
+
+# Rows per multi-row INSERT statement for DataFrame.to_sql
+INSERT_CHUNKSIZE = 5000
+
 # Create SQLAlchemy engine using the database URL
-engine = create_engine(DB_URL)
+engine = create_engine(DB_URL, **ENGINE_OPTS)
+
+# Cell strings read as missing, matching pandas.read_excel's default
+# na_values (both workbooks spell empty fields as 'NULL')
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+    'n/a', 'nan', 'null',
+]
+
+# Indexes on raw_addresses backing the blocking and exact-match lookups
+ADDR_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_raw_addr_house "
+    "ON raw_addresses (house)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_addr_exact "
+    "ON raw_addresses (house, street, strtype, zip)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_addr_house_street_dm "
+    "ON raw_addresses (house, street_dm)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_addr_hhid "
+    "ON raw_addresses (hhid)",
+]
+
+def _write_table(df: pl.DataFrame, name: str, engine, chunk_rows: int = 10_000):
+    """
+    Write a Polars frame to `name` in chunks of `chunk_rows`, replacing any
+    existing table, so only one chunk is converted to pandas at a time.
+    """
+    if_exists = 'replace'
+    for chunk in df.iter_slices(chunk_rows):
+        chunk.to_pandas().to_sql(
+            name,
+            engine,
+            if_exists=if_exists,
+            index=False,
+            method='multi',
+            chunksize=INSERT_CHUNKSIZE
+        )
+        if_exists = 'append'
+
+
+def _read_excel(path: str, **kwargs) -> pl.DataFrame:
+    """
+    Read a workbook with `pl.read_excel`, turning NA_VALUES strings in any
+    text column into nulls.
+    """
+    df = pl.read_excel(path, **kwargs)
+    return df.with_columns([
+        pl.when(pl.col(c).is_in(NA_VALUES)).then(None).otherwise(pl.col(c)).alias(c)
+        for c, dtype in df.schema.items() if dtype == pl.Utf8
+    ])
+
+
+def _upper_strip(df: pl.DataFrame, cols) -> pl.DataFrame:
+    """
+    Normalize the given text columns to stripped uppercase ('' for nulls)
+    in one vectorized pass.
+    """
+    return df.with_columns([
+        pl.col(c).cast(pl.Utf8).fill_null('').str.strip_chars().str.to_uppercase()
+        for c in cols if c in df.columns
+    ])
+
 
 def ingest(engine):
     """
@@ -19,30 +90,44 @@ def ingest(engine):
     """
 
     # Read transaction data from Excel
-    df_tx = pd.read_excel('transactions_2_11211.xlsx')
+    df_tx = _read_excel('transactions_2_11211.xlsx')
 
     # Normalize selected text fields to uppercase
     tx_upper_cols = [
         'address_line_1', 'address_line_2', 'city', 'state'
     ]
-    for col in tx_upper_cols:
-        if col in df_tx.columns:
-            df_tx[col] = df_tx[col].fillna('').astype(str).str.strip().str.upper()
+    df_tx = _upper_strip(df_tx, tx_upper_cols)
 
     # Insert transaction data into raw_transactions table
-    df_tx.to_sql('raw_transactions', engine, if_exists='replace', index=False)
+    _write_table(df_tx, 'raw_transactions', engine)
 
-    # Read canonical address data from Excel
-    df_addr = pd.read_excel('11211 Addresses.xlsx')
+    # Read canonical address data from Excel; house, unit and ZIP are read as
+    # text, since type inference from the first rows would null out
+    # alphanumeric values such as '263A' or '146 1/2'
+    df_addr = _read_excel(
+        '11211 Addresses.xlsx',
+        schema_overrides={'house': pl.Utf8, 'aptnbr': pl.Utf8, 'zip': pl.Utf8}
+    )
 
-    # Normalize selected address fields to uppercase
+    # Normalize selected address fields to uppercase, so matchers can compare
+    # stored values directly
     addr_upper_cols = [
-        'street', 'strtype', 'apttype', 'aptnbr',
-        'predir', 'postdir', 'city', 'state'
+        'house', 'street', 'strtype', 'apttype', 'aptnbr',
+        'predir', 'postdir', 'city', 'state', 'zip', 'address'
     ]
-    for col in addr_upper_cols:
-        if col in df_addr.columns:
-            df_addr[col] = df_addr[col].fillna('').astype(str).str.strip().str.upper()
+    df_addr = _upper_strip(df_addr, addr_upper_cols)
+
+    # Precompute the Double Metaphone code of each street for phonetic blocking
+    df_addr = df_addr.with_columns(
+        pl.col('street')
+          .map_elements(lambda s: doublemetaphone(s)[0], return_dtype=pl.Utf8)
+          .alias('street_dm')
+    )
 
     # Insert address data into raw_addresses table
-    df_addr.to_sql('raw_addresses', engine, if_exists='replace', index=False)
+    _write_table(df_addr, 'raw_addresses', engine)
+
+    # Recreate lookup indexes (to_sql 'replace' drops existing indexes)
+    with engine.begin() as conn:
+        for stmt in ADDR_INDEXES:
+            conn.execute(text(stmt))
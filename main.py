@@ -1,14 +1,19 @@
 import pandas as pd
+import polars as pl
 import time
 import os
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
 # Custom pipeline components
-from ingest import ingest
-from parse import parse_address
-from match import exact_match, fuzzy_match
-from fallback import phonetic_match, api_match, embedding_match
+from ingest import ingest, ENGINE_OPTS, INSERT_CHUNKSIZE
+from parse import parse_row
+from canon import load_canon, canon_address
+from match import exact_match_all
+from pipeline import run_waterfall, FALLBACK_TIERS
 
 # Load environment variables from .env
 load_dotenv()
@@ -16,11 +21,22 @@ load_dotenv()
 # Use DB connection string from environment variable
 DB_URL = os.getenv("DB_URL")
 
+# Columns of each match result record
+RESULT_FIELDS = [
+    'transaction_id', 'address_id', 'matched_address',
+    'confidence', 'match_type', 'reason'
+]
+
+# Result records buffered per write to the matches table
+RESULT_CHUNK_ROWS = 10_000
+
 def parse_all(engine):
     """
     Reads raw transaction addresses from the database,
     parses them into normalized components using `usaddress`,
     and writes parsed results into `parsed_transactions` table.
+
+    Parsing is CPU-bound, so rows are spread over a process pool.
     """
     conn = engine.connect()
     result = conn.execute(text(
@@ -29,117 +45,113 @@ def parse_all(engine):
         "FROM raw_transactions"
     ))
 
-    rows = result.mappings().all()
-    parsed = []
+    rows = [tuple(row) for row in result.all()]
 
     # Parse each full address using the custom parse_address function
-    for row in rows:
-        p = parse_address(row['id'], row['full_addr'])
-        p['city'] = row['city']
-        p['state'] = row['state']
-        p['zip_code'] = row['zip_code']
-        if p:
-            parsed.append(p)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        parsed = [p for p in ex.map(parse_row, rows, chunksize=1000) if p]
 
     # Write parsed results to DB
     pd.DataFrame(parsed).to_sql(
         'parsed_transactions',
         engine,
         if_exists='replace',
-        index=False
+        index=False,
+        method='multi',
+        chunksize=INSERT_CHUNKSIZE
     )
 
 def match_all(engine):
     """
     Attempts to match each parsed transaction record to a canonical address using
     a prioritized waterfall strategy (exact → fuzzy → phonetic → embedding → API).
-    Writes both matched and unmatched results to the database and output files.
+    Writes both matched and unmatched results to the database and output files,
+    streaming them out rather than collecting them all in memory.
+
+    Parsed transactions are fetched once and matched against the resident
+    canonical table (see `canon.load_canon`); exact matching is one SQL join.
+    The rest are matched in slices of RESULT_CHUNK_ROWS: the fallback tiers
+    (see `pipeline.FALLBACK_TIERS`) each run in-process over all of a slice's
+    still-unmatched rows, and the slice's results are written out before the
+    next slice is matched, so memory stays bounded by the slice size.
+    Everything runs on one connection inside a single transaction.
     """
-    conn = engine.connect()
-    result = conn.execute(text("SELECT * FROM parsed_transactions"))
-    parsed_rows = result.mappings().all()
+    with engine.begin() as conn:
+        load_canon(conn, refresh=True)
+        tx = pl.read_database("SELECT * FROM parsed_transactions", conn) \
+            .with_columns(pl.col(pl.Utf8).fill_null(''))
+
+        # 1. Exact match: resolve every exact hit with one SQL join
+        exact_hits = exact_match_all(conn)
+
+        # Stream results: DB and CSV per slice, unmatched report row by row
+        conn.execute(text("DROP TABLE IF EXISTS matches"))
+        _write_matches(conn, [])
+        with open('matched_output.csv', 'w', newline='') as csv_file, \
+                open('unmatched_report.jsonl', 'w') as unmatched_file:
+            writer = csv.DictWriter(csv_file, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+
+            for tx_slice in tx.iter_slices(RESULT_CHUNK_ROWS):
+                chunk = _match_slice(conn, tx_slice, exact_hits)
+                writer.writerows(chunk)
+                for result in chunk:
+                    if result['match_type'] == 'unmatched':
+                        unmatched_file.write(json.dumps(result) + '\n')
+                _write_matches(conn, chunk)
+
+
+def _match_slice(conn, tx_slice, exact_hits):
+    """
+    Match one slice of parsed transactions, returning one result record per
+    row, in input order.
+    """
+    rows = tx_slice.to_dicts()
+
+    # 2-5. Fallback tiers for every row the exact join did not resolve
+    residual = [i for i, row in enumerate(rows) if row['id'] not in exact_hits]
+    outcomes = dict(zip(
+        residual,
+        run_waterfall(conn, [rows[i] for i in residual], FALLBACK_TIERS)
+    ))
 
     results = []
-    for row in parsed_rows:
+    for i, row in enumerate(rows):
         tx_id = row['id']
-        hhid, score, mtype, reason = None, 0.0, None, ''
-
         # 1. Exact match
-        hhid, score = exact_match(conn, row)
-        if hhid:
-            mtype = 'exact'
-            reason = 'exact match'
+        if tx_id in exact_hits:
+            hhid, score, mtype, reason = exact_hits[tx_id], 1.0, 'exact', 'exact match'
         else:
-            reason = 'no exact match'
-
-            # 2. Fuzzy match
-            hhid, score = fuzzy_match(conn, row)
-            if hhid:
-                mtype = 'fuzzy'
-                reason = 'fuzzy match'
-            else:
-                reason = 'low fuzzy score'
-
-                # 3. Phonetic match
-                hhid, score = phonetic_match(conn, row)
-                if hhid:
-                    mtype = 'phonetic'
-                    reason = 'phonetic match'
-                else:
-                    reason = 'no phonetic match'
-
-                    # 4. Embedding match
-                    hhid, score = embedding_match(conn, row, emb_threshold=0.75)
-                    if hhid:
-                        mtype = 'embedding'
-                        reason = 'embedding match'
-                    else:
-                        reason = 'low embedding score'
-
-                        # 5. API match
-                        hhid, score, api_reason = api_match(conn, row)
-                        if hhid:
-                            mtype = 'api'
-                            reason = api_reason
-                        else:
-                            mtype = 'unmatched'
-                            reason = api_reason
-
-        # Retrieve matched canonical address from DB
-        matched_address = ''
-        if hhid:
-            address_row = conn.execute(
-                text("SELECT address FROM raw_addresses WHERE hhid = :hhid"),
-                {'hhid': hhid}
-            ).mappings().first()
-            if address_row:
-                matched_address = address_row['address']
-
-        # Append result record
+            hhid, score, mtype, reason = outcomes[i]
+
+        # Result record, looking up the canonical address by hhid
         results.append({
             'transaction_id': tx_id,
             'address_id': hhid,
-            'matched_address': matched_address,
+            'matched_address': canon_address(conn, hhid),
             'confidence': score,
             'match_type': mtype,
             'reason': reason
         })
+    return results
 
-    # Save match results to DB and export output files
-    df_res = pd.DataFrame(results)
-    df_res.to_sql(
+
+def _write_matches(conn, chunk):
+    """
+    Append a chunk of result records to the `matches` table.
+    """
+    pd.DataFrame(chunk, columns=RESULT_FIELDS).to_sql(
         'matches',
-        engine,
-        if_exists='replace',
-        index=False
+        conn,
+        if_exists='append',
+        index=False,
+        method='multi',
+        chunksize=INSERT_CHUNKSIZE
     )
-    df_res.to_csv('matched_output.csv', index=False)
-    df_res[df_res['match_type'] == 'unmatched'] \
-        .to_json('unmatched_report.json', orient='records', indent=2)
 
 # Entry point to run the full pipeline end-to-end
 if __name__ == '__main__':
-    engine = create_engine(DB_URL)
+    engine = create_engine(DB_URL, **ENGINE_OPTS)
     start = time.time()
 
     ingest(engine)
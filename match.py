@@ -1,99 +1,114 @@
-from rapidfuzz import fuzz
+import numpy as np
+import polars as pl
+from rapidfuzz import fuzz, process
 from sqlalchemy import text
 
+from canon import get_block
+
+# Blocks scored with fewer comparisons than this run cdist single-threaded;
+# below it, spinning up the thread pool costs more than the scoring
+PARALLEL_MIN_PAIRS = 10_000
+
 
 def exact_match(conn, parsed: dict):
     """
     Attempt exact match of parsed transaction address against canonical addresses.
     Matching is done on street number, directionals, street name/type, and unit info.
     Returns a tuple of (hhid, confidence), where confidence is 1.0 if matched.
+
+    Candidates come from the in-memory canonical block for the street number;
+    empty components are stored as '' on both sides, so plain equality also
+    covers the "both blank" case. When several households share the
+    address, the smallest hhid wins, as in `exact_match_all`.
     """
-    q = text("""
-        SELECT hhid
-          FROM raw_addresses
-         WHERE house   = :street_number
-           AND (
-                (predir   = :predir)
-             OR (predir   = '' AND :predir   = '')
-               )
-           AND street  = :street_name
-           AND strtype = :street_type
-           AND (
-                (postdir  = :postdir)
-             OR (postdir  = '' AND :postdir  = '')
-               )
-           AND (
-                (apttype  = :apt_type AND aptnbr = :unit)
-             OR ( :apt_type = ''   AND :unit    = '' 
-                  AND apttype = ''   AND aptnbr  = '' )
-               )
-    """)
-    # Execute query with parameters from parsed input
-    row = conn.execute(q, parsed).mappings().first()
+    num = parsed.get('street_number', '')
+    if not num:
+        return None, 0.0  # Can't match without street number
+
+    block = get_block(conn, num)
+    hits = block.filter(
+        (pl.col('predir') == parsed.get('predir', ''))
+        & (pl.col('street') == parsed.get('street_name', ''))
+        & (pl.col('strtype') == parsed.get('street_type', ''))
+        & (pl.col('postdir') == parsed.get('postdir', ''))
+        & (pl.col('apttype') == parsed.get('apt_type', ''))
+        & (pl.col('aptnbr') == parsed.get('unit', ''))
+    ).sort('hhid')
 
     # If a match is found, return hhid with confidence score of 1.0
-    return (row['hhid'], 1.0) if row else (None, 0.0)
+    return (hits['hhid'][0], 1.0) if not hits.is_empty() else (None, 0.0)
+
+
+def exact_match_all(conn) -> dict:
+    """
+    Exact match every parsed transaction in one SQL join.
 
+    Joins `parsed_transactions` to `raw_addresses` on house number and every
+    address component, so all exact hits resolve in a single round-trip;
+    rows without a street number never match, and when several households
+    share an address the smallest hhid wins.
+    Returns a dict of transaction id -> hhid for the rows that matched.
+    """
+    q = text("""
+        SELECT DISTINCT ON (p.id) p.id, r.hhid
+          FROM parsed_transactions p
+          JOIN raw_addresses r
+            ON r.house   = p.street_number
+           AND r.predir  = p.predir
+           AND r.street  = p.street_name
+           AND r.strtype = p.street_type
+           AND r.postdir = p.postdir
+           AND r.apttype = p.apt_type
+           AND r.aptnbr  = p.unit
+         WHERE p.street_number <> ''
+         ORDER BY p.id, r.hhid
+    """)
+    return dict(conn.execute(q).all())
 
-def fuzzy_match(conn, parsed: dict, threshold: float = 70.0):
+
+def fuzzy_match_many(parsed_rows, block: pl.DataFrame, threshold: float = 70.0):
     """
-    Attempt fuzzy match of parsed transaction address against canonical addresses.
+    Fuzzy match several parsed addresses against one shared canonical block.
 
-    Matching strategy:
-    1) Block on street number (to reduce candidate pool).
-    2) Fuzzy compare the full street string (e.g. "N Main Street").
-    3) Require unit number to match exactly.
-    4) Return the best match if the fuzzy score exceeds the threshold.
+    All parsed rows are scored against all candidates with a single
+    `process.cdist` call, so the scoring loop runs in C rather than paying
+    Python call overhead per comparison.
 
-    Returns (hhid, score) if matched, else (None, 0.0).
+    Returns a list of (hhid, score, best_score) tuples, one per parsed row,
+    where best_score is the top raw score even when the match is rejected
+    (used to decide whether later tiers are worth running).
     """
-    num = parsed.get('street_number', '').strip()
-    if not num:
-        return None, 0.0  # Can't match without street number
+    if block.is_empty():
+        return [(None, 0.0, 0.0)] * len(parsed_rows)
 
-    # Build the parsed full street string (used for fuzzy matching)
-    tokens = [
-        parsed.get('predir', ''),
-        parsed.get('street_name', ''),
-        parsed.get('street_type', ''),
-        parsed.get('postdir', '')
-    ]
-    parsed_full = ' '.join(t for t in tokens if t).upper()
+    # Full street strings precomputed by parse_address and load_canon
+    parsed_fulls = [p.get('parsed_full', '') for p in parsed_rows]
+    canon_fulls = block['canon_full'].to_list()
+    hhids = block['hhid'].to_list()
+    aptnbrs = block['aptnbr'].to_list()
 
-    # Query candidates that share the same street number (blocking)
-    q = text("""
-        SELECT hhid, predir, street, strtype, postdir, apttype, aptnbr
-          FROM raw_addresses
-         WHERE house = :num
-    """)
-    candidates = conn.execute(q, {'num': num}).mappings().all()
-
-    # Initialize best match tracker
-    best = {'hhid': None, 'score': 0.0, 'apttype': '', 'aptnbr': ''}
-    for r in candidates:
-        # Construct full canonical street string
-        canon_tokens = [
-            r.get('predir', ''),
-            r['street'],
-            r.get('strtype', ''),
-            r.get('postdir', '')
-        ]
-        canon_full = ' '.join(t for t in canon_tokens if t).upper()
-
-        # Compute fuzzy similarity score
-        score = fuzz.token_sort_ratio(parsed_full, canon_full)
-        if score > best['score']:
-            best.update({
-                'hhid': r['hhid'],
-                'score': score,
-                'apttype': r.get('apttype', ''),
-                'aptnbr': r.get('aptnbr', '')
-            })
-
-    # Check if best score is above threshold and unit matches
-    if best['score'] >= threshold:
-        if parsed.get('unit', '') == best['aptnbr']:
-            return best['hhid'], round(best['score'], 2)
-
-    # No match found
-    return None, 0.0
\ No newline at end of file
+    # Score every parsed row against every candidate in one call
+    pairs = len(parsed_fulls) * len(canon_fulls)
+    scores = process.cdist(
+        parsed_fulls,
+        canon_fulls,
+        scorer=fuzz.token_sort_ratio,
+        workers=-1 if pairs >= PARALLEL_MIN_PAIRS else 1
+    )
+
+    matches = []
+    for p, row_scores in zip(parsed_rows, scores):
+        # Can't match without street number
+        if not p.get('street_number', ''):
+            matches.append((None, 0.0, 0.0))
+            continue
+
+        # Check if best score is above threshold and unit matches
+        best = int(np.argmax(row_scores))
+        best_score = float(row_scores[best])
+        if best_score >= threshold and p.get('unit', '') == aptnbrs[best]:
+            matches.append((hhids[best], round(best_score, 2), best_score))
+        else:
+            matches.append((None, 0.0, best_score))
+
+    return matches
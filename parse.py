@@ -1,10 +1,22 @@
+from functools import lru_cache
+
 # Import the usaddress library for parsing structured address components
 import usaddress
+from metaphone import doublemetaphone
 
-def parse_address(record_id: str, raw_address: str) -> dict:
+# Parsed component names, in the order `_parse_cached` returns them
+PARSED_FIELDS = (
+    'street_number', 'predir', 'street_name', 'street_type', 'postdir',
+    'apt_type', 'unit', 'parsed_full', 'street_name_dm'
+)
+
+
+@lru_cache(maxsize=200_000)
+def _parse_cached(raw_address: str) -> tuple:
     """
-    Use usaddress to tag and split into components.
-    Returns a dict suitable for DataFrame ingestion.
+    Tag and normalize one raw address string.
+    Memoized on the raw string, since duplicate addresses are common;
+    returns a tuple of components in PARSED_FIELDS order.
     """
 
     # Parse the raw address into tagged components using usaddress
@@ -31,16 +43,41 @@ def parse_address(record_id: str, raw_address: str) -> dict:
     # Extract directional suffix (e.g., "NW", "SE")
     postdir = parsed.get('StreetNamePostDirectional', '').strip().upper()
 
+    # Full street string shared by the fuzzy, phonetic and embedding matchers
+    parsed_full = ' '.join(t for t in (predir, street_name, street_type, postdir) if t)
+
+    # Double Metaphone code of the street name, used for phonetic blocking
+    street_name_dm = doublemetaphone(street_name)[0]
+
+    return (
+        street_number, predir, street_name, street_type, postdir,
+        apt_type, unit, parsed_full, street_name_dm
+    )
+
+
+def parse_address(record_id: str, raw_address: str) -> dict:
+    """
+    Use usaddress to tag and split into components.
+    Returns a dict suitable for DataFrame ingestion.
+    """
 
     # Return a dictionary of parsed components with original record ID and address
     return {
         'id': record_id,
-        'street_number': street_number,
-        'predir': predir,
-        'street_name': street_name,
-        'street_type': street_type,
-        'postdir': postdir,
-        'apt_type': apt_type,
-        'unit': unit,
+        **dict(zip(PARSED_FIELDS, _parse_cached(raw_address))),
         'original_address': raw_address
     }
+
+
+def parse_row(row) -> dict:
+    """
+    Parse one (id, full_addr, city, state, zip_code) row.
+    Lives here rather than in main.py so `parse_all`'s worker processes only
+    import usaddress and metaphone, not the matching pipeline and its model.
+    """
+    record_id, full_addr, city, state, zip_code = row
+    p = parse_address(record_id, full_addr)
+    p['city'] = city
+    p['state'] = state
+    p['zip_code'] = zip_code
+    return p
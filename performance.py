@@ -4,7 +4,7 @@ import psutil
 import os
 from sqlalchemy import create_engine
 from parse import parse_address
-from fallback import api_match as real_api_match
+from fallback import api_match_many as real_api_match_many
 import fallback
 from dotenv import load_dotenv
 
@@ -14,9 +14,11 @@ load_dotenv()
 # Override real API call with stub for main matching logic
 # This ensures scalability testing doesn't hit rate-limited APIs
 fallback.api_match = lambda conn, p: (None, 0.0, "stubbed")
+fallback.api_match_many = lambda conn, ps: [(None, 0.0, "stubbed")] * len(ps)
 
 # Import pipeline functions
 from main import parse_all, match_all
+from ingest import ENGINE_OPTS, INSERT_CHUNKSIZE
 
 # Cost per 1,000 API calls (used for cost estimation)
 RATE_PER_1K = 0.5
@@ -35,13 +37,20 @@ def scale_test(factor: int):
     - Estimating extrapolated cost for full 200M-row scale
     - Sampling API usage separately on 1K rows
     """
-    engine = create_engine(DB_URL)
+    engine = create_engine(DB_URL, **ENGINE_OPTS)
     with engine.connect() as conn:
 
         # 1) Build large dataset by duplicating base rows
         df = pd.read_excel(BASE_FILE)
         df_large = pd.concat([df] * factor, ignore_index=True)
-        df_large.to_sql('raw_transactions', conn, if_exists='replace', index=False)
+        df_large.to_sql(
+            'raw_transactions',
+            conn,
+            if_exists='replace',
+            index=False,
+            method='multi',
+            chunksize=INSERT_CHUNKSIZE
+        )
 
         # 2) Record memory usage before parse/match
         proc = psutil.Process()
@@ -79,13 +88,15 @@ def scale_test(factor: int):
         # 6) Test real API matching on 1,000-row sample for rate/cost estimation
         sample = df.sample(1000, replace=True)
         start = time.time()
+        parsed_list = []
         for _, row in sample.iterrows():
             raw = f"{row['address_line_1']} {row['address_line_2']}".strip()
             parsed = parse_address("sample", raw)
             parsed['city'] = row.get('city', '')
             parsed['state'] = row.get('state', '')
             parsed['zip_code'] = row.get('zip_code', '')
-            real_api_match(conn, parsed)
+            parsed_list.append(parsed)
+        real_api_match_many(conn, parsed_list)
         elapsed = time.time() - start
 
         # Compute throughput and cost estimate
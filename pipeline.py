@@ -0,0 +1,134 @@
+from canon import get_block
+from match import exact_match, fuzzy_match_many
+from fallback import (
+    phonetic_match_block, embedding_match_many, api_match, api_match_many
+)
+
+# Best raw fuzzy score at or above which the embedding tier is skipped:
+# a street string that close has already been judged on the same text, so
+# the transformer pass is not worth its cost
+EMB_MAX_FUZZY = 60.0
+
+
+def _exact_tier(conn, items):
+    """
+    Exact match each row against its house-number block.
+    """
+    found = []
+    for item in items:
+        hhid, score = exact_match(conn, item['row'])
+        found.append((hhid, score, 'exact match' if hhid else 'no exact match'))
+    return found
+
+
+def _fuzzy_tier(conn, items):
+    """
+    Fuzzy match rows, scoring all rows that share a block in one call.
+    Records each row's best raw fuzzy score for the embedding gate.
+    """
+    found = [None] * len(items)
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(id(item['block']), []).append(i)
+
+    for idxs in groups.values():
+        block = items[idxs[0]]['block']
+        scored = fuzzy_match_many([items[i]['row'] for i in idxs], block)
+        for i, (hhid, score, best_score) in zip(idxs, scored):
+            items[i]['fuzzy_score'] = best_score
+            found[i] = (hhid, score, 'fuzzy match' if hhid else 'low fuzzy score')
+    return found
+
+
+def _phonetic_tier(conn, items):
+    """
+    Phonetic match each row against its house-number block.
+    """
+    found = []
+    for item in items:
+        hhid, score = phonetic_match_block(item['row'], item['block'])
+        found.append((hhid, score, 'phonetic match' if hhid else 'no phonetic match'))
+    return found
+
+
+def _embedding_tier(conn, items):
+    """
+    Embedding match, in one batch, only the rows whose fuzzy score was too
+    low for the street to be a near miss and that have candidates at all.
+    """
+    found = [(None, 0.0, 'low embedding score')] * len(items)
+    todo = [
+        i for i, item in enumerate(items)
+        if item['fuzzy_score'] < EMB_MAX_FUZZY and not item['block'].is_empty()
+    ]
+    embedded = embedding_match_many(
+        [(items[i]['row'], items[i]['block']) for i in todo],
+        emb_threshold=0.75
+    )
+    for i, (hhid, score) in zip(todo, embedded):
+        if hhid:
+            found[i] = (hhid, score, 'embedding match')
+    return found
+
+
+def _api_tier(conn, items):
+    """
+    Last resort: external address validation API, batched over all
+    remaining rows. A single row (e.g. a Flask request) takes one plain
+    GET instead of the batch endpoint and its worker pool.
+    """
+    if len(items) == 1:
+        return [api_match(conn, items[0]['row'])]
+    return api_match_many(conn, [item['row'] for item in items])
+
+
+# Fallback tiers for rows without an exact match, cheapest first:
+# (match_type, tier function)
+FALLBACK_TIERS = [
+    ('fuzzy', _fuzzy_tier),
+    ('phonetic', _phonetic_tier),
+    ('embedding', _embedding_tier),
+    ('api', _api_tier),
+]
+
+# Full matching waterfall
+TIERS = [('exact', _exact_tier)] + FALLBACK_TIERS
+
+
+def run_waterfall(conn, rows, tiers=TIERS):
+    """
+    Run parsed rows through the matching tiers in order.
+
+    Each tier sees every row still unmatched after the previous one, so
+    batched tiers amortize their work across all of them, and rows leave
+    the waterfall as soon as a tier matches them.
+
+    Returns a list of (hhid, score, match_type, reason) tuples, one per row;
+    rows no tier matched get match_type 'unmatched' and the last tier's reason.
+    """
+    items = [
+        {
+            'row': row,
+            'block': get_block(conn, row.get('street_number', '')),
+            'fuzzy_score': 0.0
+        }
+        for row in rows
+    ]
+
+    outcomes = [(None, 0.0, 'unmatched', 'unmatched')] * len(items)
+    pending = list(range(len(items)))
+    for mtype, tier in tiers:
+        if not pending:
+            break
+
+        remaining = []
+        found = tier(conn, [items[i] for i in pending])
+        for i, (hhid, score, reason) in zip(pending, found):
+            if hhid:
+                outcomes[i] = (hhid, score, mtype, reason)
+            else:
+                outcomes[i] = (None, score, 'unmatched', reason)
+                remaining.append(i)
+        pending = remaining
+
+    return outcomes
@@ -46,7 +46,8 @@ CREATE TABLE raw_addresses (
   apttype TEXT, aptnbr TEXT,
   city TEXT, state TEXT, zip TEXT,
   latitude DOUBLE PRECISION, longitude DOUBLE PRECISION,
-  homeownercd TEXT
+  homeownercd TEXT,
+  street_dm TEXT
 );
 
 -- Create table for parsed address components from transaction data
@@ -59,6 +60,8 @@ CREATE TABLE parsed_transactions (
   postdir          TEXT,
   apt_type         TEXT,
   unit             TEXT,
+  parsed_full      TEXT,
+  street_name_dm   TEXT,
   city             TEXT,
   state            TEXT,
   zip_code         TEXT,
@@ -78,3 +81,10 @@ CREATE INDEX idx_parsed_street_name ON parsed_transactions (street_name);
 
 -- Create index to optimize queries on canonical street name
 CREATE INDEX idx_raw_addr_street    ON raw_addresses (street);
+
+-- Create index to block phonetic matches on house number + Double Metaphone code
+CREATE INDEX idx_raw_addr_house_street_dm ON raw_addresses (house, street_dm);
+
+-- Create indexes to optimize house-number blocking and exact-match lookups
+CREATE INDEX idx_raw_addr_house ON raw_addresses (house);
+CREATE INDEX idx_raw_addr_exact ON raw_addresses (house, street, strtype, zip);